@@ -0,0 +1,509 @@
+"""Inference backends for EasyOCR readers.
+
+EasyOCR keeps its own pre- and post-processing; a backend only swaps the
+CRAFT detector and CRNN recognizer modules of a stock ``easyocr.Reader`` for
+faster runtimes. Select one with ``EASYOCR_BACKEND``:
+
+- ``torch`` (default): stock PyTorch models, run under FP16 autocast on GPU.
+  With ``EASYOCR_COMPILE=1`` the models are also compiled with
+  ``torch.compile`` and warmed up before the reader is returned.
+- ``ort``: ONNX Runtime with every execution provider available on the host
+  (TensorRT, CUDA, CoreML, OpenVINO, ... before CPU, in ONNX Runtime's order).
+  Models are exported in FP32; with ``EASYOCR_PRECISION=int8`` the recognizer
+  is dynamically quantized to INT8 (as the stock CPU ``torch`` recognizer
+  already is) and run on the CPU execution provider.
+- ``trt``: TensorRT FP16 engines (GPU only), keyed by GPU architecture.
+
+The ``ort`` and ``trt`` backends export the models to ONNX once and cache the
+files, plus any built engines, under ``EASYOCR_ENGINE_DIR`` (default
+``~/.EasyOCR/engines``).
+"""
+
+from __future__ import annotations
+
+import copy
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Sequence, Tuple
+
+import easyocr
+import numpy as np
+import torch
+
+ENGINE_DIR = Path(os.getenv("EASYOCR_ENGINE_DIR", Path.home() / ".EasyOCR" / "engines"))
+BACKENDS = ("torch", "ort", "trt")
+PRECISIONS = ("default", "int8")
+
+Shape = Tuple[int, ...]
+
+# Optimization profile bounds as (min, opt, max) input shapes. EasyOCR pads
+# detector inputs to multiples of 32 within its 2560px canvas; recognizer crops
+# are 64px high and as wide as the longest line on the page. Larger batches are
+# split across several engine calls.
+_DETECTOR_SHAPES: Tuple[Shape, Shape, Shape] = (
+    (1, 3, 32, 32),
+    (1, 3, 1280, 1280),
+    (2, 3, 2560, 2560),
+)
+_RECOGNIZER_SHAPES: Tuple[Shape, Shape, Shape] = (
+    (1, 1, 64, 32),
+    (16, 1, 64, 512),
+    (64, 1, 64, 4096),
+)
+# Detector inputs are padded up to multiples of this many pixels when compiled,
+# so pages of slightly different sizes share one compiled graph.
+_DETECTOR_BUCKET = 256
+_WARMUP_SHAPE = (1280, 1280, 3)
+_WARMUP_TEXT = "Warmup 0123456789"
+
+_DETECTOR_AXES = {"input": {0: "batch", 2: "height", 3: "width"}, "output": {0: "batch", 1: "rows", 2: "cols"}}
+_RECOGNIZER_AXES = {"input": {0: "batch", 3: "width"}, "output": {0: "batch", 1: "steps"}}
+
+
+def _unwrap(module: torch.nn.Module) -> torch.nn.Module:
+    """Return the model inside ``DataParallel`` (EasyOCR wraps GPU models)."""
+    return getattr(module, "module", module)
+
+
+def _to_float32(output):
+    """Cast autocast outputs back to FP32; EasyOCR post-processing uses OpenCV."""
+    if isinstance(output, torch.Tensor):
+        return output.float()
+    if isinstance(output, tuple):
+        return tuple(_to_float32(o) for o in output)
+    return output
+
+
+class AutocastModule(torch.nn.Module):
+    """Run a CUDA model under FP16 autocast and inference mode.
+
+    Convolutions and LSTMs run on Tensor Cores in half precision; outputs are
+    returned as FP32 so EasyOCR's thresholding and decoding are unchanged.
+    """
+
+    def __init__(self, module: torch.nn.Module):
+        super().__init__()
+        self.module = module
+
+    def forward(self, *args):
+        with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16):
+            return _to_float32(self.module(*args))
+
+
+class BucketedDetector(torch.nn.Module):
+    """Pad CRAFT inputs to a multiple of ``step`` and crop the outputs back.
+
+    CRAFT is fully convolutional and emits maps at half the input resolution,
+    so cropping restores exactly the shapes EasyOCR expects.
+    """
+
+    def __init__(self, module: torch.nn.Module, step: int = _DETECTOR_BUCKET):
+        super().__init__()
+        self.module = module
+        self.step = step
+
+    def forward(self, x: torch.Tensor):
+        height, width = x.shape[-2:]
+        pad_h, pad_w = -height % self.step, -width % self.step
+        if pad_h or pad_w:
+            x = torch.nn.functional.pad(x, (0, pad_w, 0, pad_h))
+        y, feature = self.module(x)
+        y = y[:, : height // 2, : width // 2]
+        if feature is not None:
+            feature = feature[..., : height // 2, : width // 2]
+        return y, feature
+
+
+class _LastAxisMean(torch.nn.Module):
+    """Equivalent of ``AdaptiveAvgPool2d((None, 1))`` that exports with dynamic widths."""
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x.mean(dim=3, keepdim=True)
+
+
+class _DetectorGraph(torch.nn.Module):
+    """CRAFT forward returning only the score maps (the refiner feature is unused)."""
+
+    def __init__(self, craft: torch.nn.Module):
+        super().__init__()
+        self.craft = _unwrap(craft)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.craft(x)[0]
+
+
+class _RecognizerGraph(torch.nn.Module):
+    """CRNN forward without the ``text`` argument, which CTC models ignore."""
+
+    def __init__(self, crnn: torch.nn.Module):
+        super().__init__()
+        self.crnn = copy.deepcopy(_unwrap(crnn))
+        self.crnn.AdaptiveAvgPool = _LastAxisMean()
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.crnn(x, None)
+
+
+def _temp_path(path: Path) -> Path:
+    """A unique temporary sibling of ``path``, so concurrent writers never collide."""
+    fd, name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    return Path(name)
+
+
+def _export_onnx(
+    graph: torch.nn.Module,
+    name: str,
+    sample_shape: Shape,
+    dynamic_axes: Dict[str, Dict[int, str]],
+) -> Path:
+    """Export ``graph`` to ``ENGINE_DIR/<name>.onnx`` unless already present."""
+    path = ENGINE_DIR / f"{name}.onnx"
+    if path.exists():
+        return path
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    device = next(graph.parameters()).device
+    tmp_path = _temp_path(path)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                graph.eval(),
+                torch.zeros(sample_shape, device=device),
+                str(tmp_path),
+                input_names=["input"],
+                output_names=["output"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+            )
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return path
+
+
+_TRT_LOGGER = None
+
+
+def _tensorrt():
+    """Import TensorRT lazily; it is only needed for the ``trt`` backend."""
+    global _TRT_LOGGER
+    try:
+        import tensorrt as trt  # type: ignore
+    except ImportError as e:  # pragma: no cover - optional dependency
+        raise RuntimeError("EASYOCR_BACKEND=trt requires the 'tensorrt' package.") from e
+    if _TRT_LOGGER is None:
+        _TRT_LOGGER = trt.Logger(trt.Logger.WARNING)
+    return trt, _TRT_LOGGER
+
+
+def _build_engine(
+    onnx_path: Path,
+    engine_path: Path,
+    shapes: Tuple[Shape, Shape, Shape],
+) -> Path:
+    """Build an FP16 TensorRT engine from ``onnx_path`` unless already cached."""
+    if engine_path.exists():
+        return engine_path
+
+    trt, logger = _tensorrt()
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+    if not parser.parse(onnx_path.read_bytes()):
+        errors = "; ".join(str(parser.get_error(i)) for i in range(parser.num_errors))
+        raise RuntimeError(f"Failed to parse {onnx_path.name}: {errors}")
+
+    config = builder.create_builder_config()
+    config.set_flag(trt.BuilderFlag.FP16)
+    profile = builder.create_optimization_profile()
+    profile.set_shape("input", *shapes)
+    config.add_optimization_profile(profile)
+
+    serialized = builder.build_serialized_network(network, config)
+    if serialized is None:
+        raise RuntimeError(f"TensorRT failed to build an engine from {onnx_path.name}")
+    tmp_path = _temp_path(engine_path)
+    try:
+        tmp_path.write_bytes(serialized)
+        tmp_path.replace(engine_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return engine_path
+
+
+class _TensorRTModule(torch.nn.Module):
+    """Run a single-input, single-output TensorRT engine on CUDA tensors.
+
+    Inputs are bound by device pointer, so the tensor EasyOCR already moved to
+    the GPU is read in place. Batches above the profile maximum are split;
+    other dimensions outside the profile go to ``fallback`` (the original
+    PyTorch module).
+    """
+
+    def __init__(self, engine_path: Path, fallback: torch.nn.Module):
+        super().__init__()
+        trt, logger = _tensorrt()
+        self.engine = trt.Runtime(logger).deserialize_cuda_engine(engine_path.read_bytes())
+        self.context = self.engine.create_execution_context()
+        self.fallback = fallback
+        self._lock = threading.Lock()
+        min_shape, _, max_shape = self.engine.get_tensor_profile_shape("input", 0)
+        self._min_shape = tuple(min_shape)
+        self._max_shape = tuple(max_shape)
+
+    def _supports(self, x: torch.Tensor) -> bool:
+        return all(
+            lo <= dim <= hi
+            for dim, lo, hi in zip(x.shape[1:], self._min_shape[1:], self._max_shape[1:])
+        )
+
+    def _execute(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.float().contiguous()
+        with self._lock:
+            self.context.set_input_shape("input", tuple(x.shape))
+            output = torch.empty(
+                tuple(self.context.get_tensor_shape("output")),
+                dtype=torch.float32,
+                device=x.device,
+            )
+            self.context.set_tensor_address("input", x.data_ptr())
+            self.context.set_tensor_address("output", output.data_ptr())
+            self.context.execute_async_v3(torch.cuda.current_stream(x.device).cuda_stream)
+        return output
+
+    def run(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.cat([self._execute(part) for part in x.split(self._max_shape[0])])
+
+
+class TensorRTDetector(_TensorRTModule):
+    """Drop-in for ``reader.detector``; returns ``(score_maps, None)`` like CRAFT."""
+
+    def forward(self, x: torch.Tensor):
+        if not self._supports(x):
+            return self.fallback(x)
+        return self.run(x), None
+
+
+class TensorRTRecognizer(_TensorRTModule):
+    """Drop-in for ``reader.recognizer``; the ``text`` argument is ignored."""
+
+    def forward(self, x: torch.Tensor, text: torch.Tensor | None = None) -> torch.Tensor:
+        if not self._supports(x):
+            return self.fallback(x, text)
+        return self.run(x)
+
+
+def _onnxruntime():
+    """Import ONNX Runtime lazily; it is only needed for the ``ort`` backend."""
+    try:
+        import onnxruntime as ort  # type: ignore
+    except ImportError as e:  # pragma: no cover - optional dependency
+        raise RuntimeError("EASYOCR_BACKEND=ort requires the 'onnxruntime' package.") from e
+    return ort
+
+
+def _ort_session(onnx_path: Path, providers: Sequence[str] | None = None):
+    ort = _onnxruntime()
+    options = ort.SessionOptions()
+    # Follow torch's thread count, which OCR worker processes set to their
+    # share of the cores.
+    options.intra_op_num_threads = torch.get_num_threads()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(
+        str(onnx_path),
+        sess_options=options,
+        providers=list(providers or ort.get_available_providers()),
+    )
+
+
+def _quantize_int8(onnx_path: Path) -> Path:
+    """Quantize ``onnx_path`` weights to INT8, cached as ``<name>_int8.onnx``.
+
+    Dynamic quantization stores conv, matmul and LSTM weights as INT8 and
+    quantizes activations on the fly, so no calibration data is needed. The
+    ONNX file is exported from the FP32 model, so this is what brings the
+    ``ort`` recognizer level with the stock ``torch`` one on CPU, which EasyOCR
+    already dynamic-quantizes to INT8. Any speedup over ``torch`` therefore
+    comes from ONNX Runtime's INT8 kernels (largest on CPUs with VNNI), not
+    from INT8 over FP32; compare both on the target host. Detection is
+    unaffected because only the recognizer is quantized.
+    """
+    path = onnx_path.with_name(f"{onnx_path.stem}_int8.onnx")
+    if path.exists():
+        return path
+
+    _onnxruntime()
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+
+    tmp_path = _temp_path(path)
+    try:
+        quantize_dynamic(str(onnx_path), str(tmp_path), weight_type=QuantType.QInt8)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return path
+
+
+class _OnnxRuntimeModule(torch.nn.Module):
+    """Run an ONNX Runtime session on the tensors EasyOCR passes to its models."""
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def run(self, x: torch.Tensor) -> torch.Tensor:
+        (output,) = self.session.run(["output"], {"input": x.detach().float().cpu().numpy()})
+        return torch.from_numpy(output).to(x.device)
+
+
+class OnnxRuntimeDetector(_OnnxRuntimeModule):
+    """Drop-in for ``reader.detector``; returns ``(score_maps, None)`` like CRAFT."""
+
+    def forward(self, x: torch.Tensor):
+        return self.run(x), None
+
+
+class OnnxRuntimeRecognizer(_OnnxRuntimeModule):
+    """Drop-in for ``reader.recognizer``; the ``text`` argument is ignored."""
+
+    def forward(self, x: torch.Tensor, text: torch.Tensor | None = None) -> torch.Tensor:
+        return self.run(x)
+
+
+def _gpu_arch() -> str:
+    major, minor = torch.cuda.get_device_capability()
+    return f"sm{major}{minor}"
+
+
+def _recognizer_name(reader: easyocr.Reader) -> str:
+    # EasyOCR loads one recognition model per script family (english, latin, ...).
+    return f"crnn_{reader.model_lang}"
+
+
+def _export_models(reader: easyocr.Reader) -> Tuple[Path, Path]:
+    """Export the reader's detector and recognizer to ONNX (cached by name)."""
+    detector_onnx = _export_onnx(
+        _DetectorGraph(reader.detector), "craft", _DETECTOR_SHAPES[1], _DETECTOR_AXES
+    )
+    recognizer_onnx = _export_onnx(
+        _RecognizerGraph(reader.recognizer),
+        _recognizer_name(reader),
+        _RECOGNIZER_SHAPES[1],
+        _RECOGNIZER_AXES,
+    )
+    return detector_onnx, recognizer_onnx
+
+
+def _attach_onnxruntime(reader: easyocr.Reader, precision: str) -> None:
+    detector_onnx, recognizer_onnx = _export_models(reader)
+    reader.detector = OnnxRuntimeDetector(_ort_session(detector_onnx))
+    if precision == "int8":
+        # INT8 kernels only pay off on the CPU provider.
+        recognizer = _ort_session(_quantize_int8(recognizer_onnx), ["CPUExecutionProvider"])
+    else:
+        recognizer = _ort_session(recognizer_onnx)
+    reader.recognizer = OnnxRuntimeRecognizer(recognizer)
+
+
+def _attach_tensorrt(reader: easyocr.Reader) -> None:
+    arch = _gpu_arch()
+    detector_onnx, recognizer_onnx = _export_models(reader)
+    detector_engine = _build_engine(
+        detector_onnx, ENGINE_DIR / f"craft_{arch}_fp16.engine", _DETECTOR_SHAPES
+    )
+    recognizer_engine = _build_engine(
+        recognizer_onnx,
+        ENGINE_DIR / f"{_recognizer_name(reader)}_{arch}_fp16.engine",
+        _RECOGNIZER_SHAPES,
+    )
+    reader.detector = TensorRTDetector(detector_engine, reader.detector)
+    reader.recognizer = TensorRTRecognizer(recognizer_engine, reader.recognizer)
+
+
+def _compile_models(reader: easyocr.Reader, use_gpu: bool) -> None:
+    # Compile the bare models: DataParallel's scatter/gather would split the
+    # graph, and readers only ever run on one device. Detector inputs are
+    # bucketed, so a static graph (and CUDA graph) per bucket is enough.
+    # Recognizer batches vary in both size and crop width, so that graph is
+    # compiled with symbolic shapes instead of recompiling (and eventually
+    # falling back to eager) for every new combination, and without CUDA
+    # graphs, which would record one graph per concrete shape.
+    mode = "reduce-overhead" if use_gpu else None
+    reader.detector = torch.compile(_unwrap(reader.detector), mode=mode, dynamic=False)
+    reader.recognizer = torch.compile(_unwrap(reader.recognizer), dynamic=True)
+
+
+def _warmup_image() -> np.ndarray:
+    """A blank page with one printed line, so warmup reaches the recognizer too."""
+    import cv2  # installed with easyocr
+
+    image = np.full(_WARMUP_SHAPE, 255, dtype=np.uint8)
+    cv2.putText(
+        image, _WARMUP_TEXT, (64, _WARMUP_SHAPE[0] // 2), cv2.FONT_HERSHEY_SIMPLEX, 3.0, (0, 0, 0), 6
+    )
+    return image
+
+
+def build_reader(
+    languages: Sequence[str],
+    use_gpu: bool,
+    backend: str | None = None,
+    compiled: bool | None = None,
+    precision: str | None = None,
+) -> easyocr.Reader:
+    """Create an EasyOCR reader running on the requested backend.
+
+    ``backend`` defaults to the ``EASYOCR_BACKEND`` environment variable, then
+    ``torch``; ``compiled`` defaults to ``EASYOCR_COMPILE`` and only applies to
+    the ``torch`` backend; ``precision`` defaults to ``EASYOCR_PRECISION`` and
+    ``int8`` requires the ``ort`` backend. The returned object keeps the
+    ``easyocr.Reader`` API (``readtext``, ``readtext_batched``) whatever the
+    backend.
+    """
+    backend = (backend or os.getenv("EASYOCR_BACKEND") or "torch").strip().lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EASYOCR_BACKEND {backend!r}; expected one of {BACKENDS}.")
+    if backend == "trt" and not use_gpu:
+        raise ValueError("EASYOCR_BACKEND=trt requires GPU inference.")
+    precision = (precision or os.getenv("EASYOCR_PRECISION") or "default").strip().lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown EASYOCR_PRECISION {precision!r}; expected one of {PRECISIONS}.")
+    if precision == "int8" and backend != "ort":
+        raise ValueError("EASYOCR_PRECISION=int8 requires EASYOCR_BACKEND=ort.")
+
+    if compiled is None:
+        compiled = os.getenv("EASYOCR_COMPILE", "").strip().lower() in {"1", "true", "yes", "on"}
+
+    # On CPU EasyOCR dynamic-quantizes the recognizer in place by default;
+    # quantized LSTM/Linear ops have no ONNX export, so exporting backends
+    # start from the FP32 model.
+    reader = easyocr.Reader(
+        list(languages),
+        gpu=use_gpu,
+        quantize=backend not in ("ort", "trt"),
+        cudnn_benchmark=True,
+    )
+    if backend == "ort":
+        _attach_onnxruntime(reader, precision)
+        return reader
+    if backend == "trt":
+        _attach_tensorrt(reader)
+        return reader
+
+    if compiled:
+        _compile_models(reader, use_gpu)
+    if use_gpu:
+        reader.detector = AutocastModule(reader.detector)
+        reader.recognizer = AutocastModule(reader.recognizer)
+    if compiled:
+        reader.detector = BucketedDetector(reader.detector)
+        # Trigger compilation of both models now rather than on the first
+        # real request; a blank image would never reach the recognizer. Real
+        # requests run under inference mode, and dynamo guards on it, so the
+        # warmup must too or the first request recompiles.
+        with torch.inference_mode():
+            reader.readtext(_warmup_image())
+    return reader
@@ -3,27 +3,302 @@
 from __future__ import annotations
 
 import argparse
-import json
+import os
+import queue
+import shutil
 import sys
-from io import BytesIO
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
-from typing import List, Sequence, Optional
+from typing import BinaryIO, Iterable, Iterator, List, Literal, Sequence, Optional, Tuple, Union
 
 import easyocr
 import fitz  # PyMuPDF
 import numpy as np
-from PIL import Image
+import orjson
+import torch
 
+from ocr_backends import build_reader
 
-def _load_page_as_array(page: fitz.Page, dpi: int) -> np.ndarray:
-    """Render a PDF page at the desired DPI and return an RGB numpy array."""
+# Number of rendered pages allowed to wait for OCR at any time.
+_PREFETCH_PAGES = 4
+_END_OF_DOCUMENT = object()
+# On GPU, same-sized pages are OCR'd together through ``readtext_batched``.
+# Short runs stay sequential: batching only pays off once its warmup is
+# amortized. EasyOCR stacks a run into one detector tensor, so runs are also
+# capped by total pixels (CRAFT's first block alone needs ~130 bytes of FP16
+# activations per pixel); the default fits 8 A4 pages at 150 DPI but only 2
+# at 300 DPI, which then stay sequential.
+_BATCH_PAGES = 8
+_MIN_BATCH_PAGES = 4
+_BATCH_PIXELS = int(os.getenv("OCR_BATCH_PIXELS", "10000000"))
+_RECOGNIZER_BATCH_SIZE = 16
+# Pages whose pixel standard deviation is below this are treated as blank and
+# skipped; scanner noise on an empty sheet stays well under it.
+_BLANK_STDDEV = 2.0
+# Pages whose embedded text layer has more words than this skip OCR entirely.
+_MIN_EMBEDDED_WORDS = 10
+
+ColorMode = Literal["rgb", "gray"]
+COLOR_MODES = ("gray", "rgb")
+# A rendered page image, or the items already read from the page's text layer.
+PageContent = Union[np.ndarray, List[dict]]
+
+
+def _load_page_as_array(
+    page: fitz.Page,
+    dpi: int,
+    color_mode: ColorMode = "gray",
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Render a PDF page at the desired DPI and return it as a numpy array.
+
+    ``rgb`` yields an (h, w, 3) array. ``gray`` yields an (h, w) array, a third
+    of the size; EasyOCR recognizes on grayscale anyway and accepts 2-D input
+    directly, building the 3-channel detector input itself.
+
+    If ``out`` is large enough, the page is copied into its top-left corner and
+    a view of it is returned instead of a newly allocated array.
+    """
     zoom = dpi / 72.0  # 72 DPI is the default PDF resolution
-    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    # Request the colorspace explicitly so CMYK sources are converted too.
+    colorspace = fitz.csGRAY if color_mode == "gray" else fitz.csRGB
+    pixmap = page.get_pixmap(
+        matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False
+    )
+
+    # Without alpha the samples are packed rows, so view them as an array
+    # directly instead of round-tripping through an image codec.
+    if pixmap.n == 1:
+        shape: Tuple[int, ...] = (pixmap.height, pixmap.width)
+    else:
+        shape = (pixmap.height, pixmap.width, pixmap.n)
+
+    if out is not None and out.ndim == len(shape) and all(
+        size <= limit for size, limit in zip(shape, out.shape)
+    ):
+        view = out[tuple(slice(0, size) for size in shape)]
+        # samples_mv exposes the pixmap memory without an intermediate bytes copy.
+        np.copyto(view, np.frombuffer(pixmap.samples_mv, dtype=np.uint8).reshape(shape))
+        return view
+    return np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(shape)
+
+
+def _embedded_text_entries(page: fitz.Page, dpi: int) -> Optional[List[dict]]:
+    """Return items from the page's text layer, or ``None`` if it has too few words.
+
+    Items use the same shape as OCR results (confidence 1.0) with boxes scaled
+    to ``dpi`` so they line up with boxes from rendered pages.
+    """
+    words = page.get_text("words")
+    if len(words) <= _MIN_EMBEDDED_WORDS:
+        return None
+
+    zoom = dpi / 72.0
+    entries: List[dict] = []
+    for x0, y0, x1, y1, word, *_ in words:
+        text = word.strip()
+        if not text:
+            continue
+        x0, y0, x1, y1 = x0 * zoom, y0 * zoom, x1 * zoom, y1 * zoom
+        entries.append(
+            {
+                "text": text,
+                "confidence": 1.0,
+                "bbox": [[x0, y0], [x1, y0], [x1, y1], [x0, y1]],
+            }
+        )
+    return entries
+
+
+def _common_page_shape(document: fitz.Document, dpi: int, color_mode: ColorMode) -> Tuple[int, ...]:
+    """Return the most frequent rendered page shape in ``document`` at ``dpi``.
+
+    Sizing buffers for the largest page would let a single oversized page
+    (a foldout or a poster) inflate every buffer in the pool; pages that do
+    not fit get an array of their own instead.
+    """
+    matrix = fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    shapes: Counter = Counter()
+    for page in document:
+        bounds = (page.rect * matrix).irect
+        shapes[bounds.height, bounds.width] += 1
+    height, width = shapes.most_common(1)[0][0] if shapes else (0, 0)
+    return (height, width) if color_mode == "gray" else (height, width, 3)
+
+
+class _PageBuffers:
+    """Page-sized ``uint8`` buffers recycled between the renderer and OCR.
+
+    Buffers are allocated on demand up to ``limit`` and reused afterwards, so a
+    long document churns through a handful of arrays instead of one per page.
+    Only the render thread acquires; OCR hands pages back with ``release``.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], limit: int):
+        self.shape = shape
+        self._limit = limit
+        self._buffers: List[np.ndarray] = []
+        self._owned: set = set()
+        self._free: queue.Queue = queue.Queue()
+
+    def acquire(self, cancelled: threading.Event) -> Optional[np.ndarray]:
+        """Return a free buffer, waiting for one if all are in use.
+
+        Returns ``None`` if ``cancelled`` is set while waiting.
+        """
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        if len(self._buffers) < self._limit:
+            buffer = np.empty(self.shape, dtype=np.uint8)
+            self._buffers.append(buffer)
+            self._owned.add(id(buffer))
+            return buffer
+        while not cancelled.is_set():
+            try:
+                return self._free.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        return None
+
+    def release(self, images: Iterable[np.ndarray]) -> None:
+        """Return the buffers backing ``images`` (views or whole buffers) to the pool."""
+        for image in images:
+            owner = image if image.base is None else image.base
+            if id(owner) in self._owned:
+                self._free.put(owner)
+
+
+def _render_pages(
+    document: fitz.Document,
+    dpi: int,
+    color_mode: ColorMode,
+    buffers: _PageBuffers,
+) -> Iterator[PageContent]:
+    """Yield page contents in order, rasterizing ahead of the consumer.
+
+    PyMuPDF documents must not be shared between threads, so a single producer
+    renders into a bounded queue while the caller runs OCR. Rendering time then
+    overlaps with inference instead of adding to it. Pages are views into
+    ``buffers``; the consumer releases them once OCR is done. Pages with an
+    embedded text layer are not rendered; their items are yielded instead.
+    """
+    rendered: queue.Queue = queue.Queue(maxsize=_PREFETCH_PAGES)
+    cancelled = threading.Event()
+
+    def _produce() -> None:
+        try:
+            for page in document:
+                if cancelled.is_set():
+                    return
+                entries = _embedded_text_entries(page, dpi)
+                if entries is not None:
+                    rendered.put(entries)
+                    continue
+                buffer = buffers.acquire(cancelled)
+                if buffer is None:
+                    return
+                image = _load_page_as_array(page, dpi, color_mode, out=buffer)
+                if image.base is not buffer:
+                    buffers.release([buffer])  # page did not fit; keep the buffer
+                rendered.put(image)
+        finally:
+            rendered.put(_END_OF_DOCUMENT)
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-render") as executor:
+        future = executor.submit(_produce)
+        try:
+            while True:
+                image = rendered.get()
+                if image is _END_OF_DOCUMENT:
+                    break
+                yield image
+        finally:
+            # Unblock the producer if the consumer stopped early.
+            cancelled.set()
+            while not future.done():
+                try:
+                    rendered.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+        future.result()  # re-raise rendering errors
+
+
+def _run_pages(reader: easyocr.Reader, shape: Tuple[int, ...]) -> int:
+    """Return how many ``shape``-sized pages to OCR together on ``reader``.
+
+    CPU readers go one page at a time; batching saves no kernel launches there.
+    """
+    if reader.device == "cpu":
+        return 1
+    return max(1, min(_BATCH_PAGES, _BATCH_PIXELS // max(1, shape[0] * shape[1])))
 
-    # Converting through PNG ensures we always end up with an RGB image.
-    with BytesIO(pixmap.tobytes("png")) as buffer:
-        image = Image.open(buffer).convert("RGB")
-        return np.array(image)
+
+def _group_pages(pages: Iterator[PageContent], max_pages: int) -> Iterator[List[PageContent]]:
+    """Group consecutive pages into runs of at most ``max_pages``.
+
+    Rendered pages in a run share one shape and stay within ``_BATCH_PIXELS``
+    together; pages already read from the text layer fit into any run.
+    """
+    chunk: List[PageContent] = []
+    shape = None
+    pixels = 0
+    for page in pages:
+        page_shape = page.shape if isinstance(page, np.ndarray) else None
+        page_pixels = page_shape[0] * page_shape[1] if page_shape else 0
+        if chunk and (
+            len(chunk) == max_pages
+            or pixels + page_pixels > _BATCH_PIXELS
+            or (shape is not None and page_shape is not None and page_shape != shape)
+        ):
+            yield chunk
+            chunk = []
+            shape = None
+            pixels = 0
+        chunk.append(page)
+        shape = shape or page_shape
+        pixels += page_pixels
+    if chunk:
+        yield chunk
+
+
+def _collect_entries(detections: Sequence, min_confidence: float) -> List[dict]:
+    """Collect EasyOCR detections above the confidence threshold.
+
+    Ensures outputs are JSON‑serializable: confidences and bounding boxes are
+    converted to NumPy arrays in one pass and back to built‑in floats with
+    ``tolist()``, giving bounding boxes as `[[x, y], ...]`.
+    """
+    if not detections:
+        return []
+
+    texts = [str(text).strip() for _, text, _ in detections]
+    confidences = np.fromiter(
+        (confidence for _, _, confidence in detections),
+        dtype=np.float64,
+        count=len(detections),
+    )
+    try:
+        bboxes = np.asarray([bbox for bbox, _, _ in detections], dtype=np.float64).tolist()
+    except ValueError:
+        # Ragged boxes (not 4 points each): convert them one at a time.
+        bboxes = [np.asarray(bbox, dtype=np.float64).tolist() for bbox, _, _ in detections]
+    keep = (confidences >= min_confidence).tolist()
+
+    return [
+        {
+            "text": text,
+            "confidence": confidence,
+            "bbox": bbox,
+        }
+        for text, confidence, bbox, kept in zip(texts, confidences.tolist(), bboxes, keep)
+        if kept and text
+    ]
 
 
 def _extract_page_text(
@@ -31,41 +306,90 @@ def _extract_page_text(
     image_array: np.ndarray,
     min_confidence: float,
 ) -> List[dict]:
-    """Run OCR on a numpy image and collect results above the confidence threshold.
+    """Run OCR on a numpy image and collect results above the confidence threshold."""
+    return _collect_entries(reader.readtext(image_array), min_confidence)
+
+
+def _is_blank(image: np.ndarray) -> bool:
+    """Return whether a page is (nearly) uniform and not worth running OCR on."""
+    # A sparse 1-in-16 sample rules out most pages with ink in microseconds;
+    # only candidates get the full-resolution check, so small marks still count.
+    if image[::16, ::16].std() >= _BLANK_STDDEV:
+        return False
+    return bool(image.std() < _BLANK_STDDEV)
 
-    Ensures outputs are JSON‑serializable by casting numeric types to built‑in
-    Python types (e.g., float, int) and normalizing bounding boxes to
-    `[[x, y], ...]` with float coordinates.
+
+@torch.inference_mode()
+def _extract_batch_text(
+    reader: easyocr.Reader,
+    contents: Sequence[PageContent],
+    min_confidence: float,
+) -> List[List[dict]]:
+    """Run OCR on same-sized pages, batching them on GPU when there are enough.
+
+    Text-layer pages keep their items, and blank pages get none; neither is
+    sent to OCR. Pages are passed without ``n_width``/``n_height`` so EasyOCR
+    does not resize them and bounding boxes stay in page coordinates. CPU
+    readers always go page by page: batching saves no kernel launches there,
+    and the stacked detector input multiplies peak memory by the batch size.
     """
-    results: List[dict] = []
-    for bbox, text, confidence in reader.readtext(image_array):
-        try:
-            conf_f = float(confidence)
-        except Exception:
-            conf_f = float(confidence.item()) if hasattr(confidence, "item") else 0.0
-        if conf_f < min_confidence or not str(text).strip():
-            continue
+    results: List[List[dict]] = [[] for _ in contents]
+    inked: List[int] = []
+    for index, content in enumerate(contents):
+        if not isinstance(content, np.ndarray):
+            results[index] = content
+        elif not _is_blank(content):
+            inked.append(index)
+    pages = [contents[index] for index in inked]
 
-        # bbox from EasyOCR is a list of 4 points; ensure pure Python floats
-        py_bbox = []
-        try:
-            for pt in bbox:
-                x, y = pt
-                py_bbox.append([float(x), float(y)])
-        except Exception:
-            # Fallback: coerce anything iterable to float list
-            py_bbox = [[float(p) for p in (pt if hasattr(pt, "__iter__") else [pt])] for pt in bbox]
-
-        results.append(
-            {
-                "text": str(text).strip(),
-                "confidence": conf_f,
-                "bbox": py_bbox,
-            }
-        )
+    if reader.device == "cpu" or len(pages) < _MIN_BATCH_PAGES:
+        entries = [_extract_page_text(reader, image, min_confidence) for image in pages]
+    else:
+        batched = reader.readtext_batched(pages, batch_size=_RECOGNIZER_BATCH_SIZE)
+        entries = [_collect_entries(detections, min_confidence) for detections in batched]
+
+    for index, page_entries in zip(inked, entries):
+        results[index] = page_entries
     return results
 
 
+def iter_pdf_text(
+    pdf_path: Path,
+    languages: Sequence[str],
+    dpi: int,
+    min_confidence: float,
+    use_gpu: bool,
+    reader: Optional[easyocr.Reader] = None,
+    color_mode: ColorMode = "gray",
+) -> Iterator[dict]:
+    """Run OCR over a PDF and yield one ``{"page", "items"}`` dict per page.
+
+    If ``reader`` is provided, reuse it; otherwise create a new Reader using
+    ``languages`` and ``use_gpu`` on the backend chosen by ``EASYOCR_BACKEND``.
+    Pages with an embedded text layer are read from it directly; the rest are
+    rendered in grayscale unless ``color_mode`` is ``rgb`` and OCR'd.
+    """
+    reader = reader or build_reader(languages, use_gpu)
+    page_index = 0
+
+    with fitz.open(pdf_path) as document:
+        shape = _common_page_shape(document, dpi, color_mode)
+        run_pages = _run_pages(reader, shape)
+        # Enough buffers for the run being OCR'd, the prefetched pages behind
+        # it and the page being rendered.
+        buffers = _PageBuffers(shape, limit=run_pages + _PREFETCH_PAGES + 1)
+        with closing(_render_pages(document, dpi, color_mode, buffers)) as contents:
+            for chunk in _group_pages(contents, run_pages):
+                page_entries = _extract_batch_text(reader, chunk, min_confidence)
+                buffers.release(page for page in chunk if isinstance(page, np.ndarray))
+                for entries in page_entries:
+                    page_index += 1
+                    yield {
+                        "page": page_index,
+                        "items": entries,
+                    }
+
+
 def extract_pdf_text(
     pdf_path: Path,
     languages: Sequence[str],
@@ -73,26 +397,29 @@ def extract_pdf_text(
     min_confidence: float,
     use_gpu: bool,
     reader: Optional[easyocr.Reader] = None,
+    color_mode: ColorMode = "gray",
 ) -> List[dict]:
     """Iterate through pages in a PDF and run OCR, returning structured data.
 
-    If ``reader`` is provided, reuse it; otherwise create a new Reader using
-    ``languages`` and ``use_gpu``.
+    See ``iter_pdf_text``; prefer it with ``write_pages_json`` for large files.
     """
-    reader = reader or easyocr.Reader(list(languages), gpu=use_gpu)
-    pages_output = []
+    return list(
+        iter_pdf_text(pdf_path, languages, dpi, min_confidence, use_gpu, reader, color_mode)
+    )
 
-    with fitz.open(pdf_path) as document:
-        for page_index, page in enumerate(document, start=1):
-            image_array = _load_page_as_array(page, dpi)
-            entries = _extract_page_text(reader, image_array, min_confidence)
-            pages_output.append(
-                {
-                    "page": page_index,
-                    "items": entries,
-                }
-            )
-    return pages_output
+
+def write_pages_json(pages: Iterable[dict], out: BinaryIO) -> None:
+    """Write pages to ``out`` as a JSON array, one page per line, as they arrive.
+
+    Each page is serialized with ``orjson`` (which also accepts NumPy values)
+    and written before the next one is produced, so neither the page objects
+    nor the encoded document accumulate in memory.
+    """
+    out.write(b"[")
+    for index, page in enumerate(pages):
+        out.write(b",\n" if index else b"\n")
+        out.write(orjson.dumps(page, option=orjson.OPT_SERIALIZE_NUMPY))
+    out.write(b"\n]\n")
 
 
 def _parse_languages(value: str) -> List[str]:
@@ -125,6 +452,12 @@ def build_arg_parser() -> argparse.ArgumentParser:
         default=0.2,
         help="Minimum OCR confidence (0-1) required to keep a detection (default: 0.2).",
     )
+    parser.add_argument(
+        "--color-mode",
+        choices=COLOR_MODES,
+        default="gray",
+        help="Rasterize pages in grayscale (default) or RGB; RGB can help with colored text.",
+    )
     parser.add_argument(
         "--gpu",
         action="store_true",
@@ -145,19 +478,33 @@ def main(args: Sequence[str] | None = None) -> int:
     if not options.pdf.exists():
         parser.error(f"PDF not found: {options.pdf}")
 
-    pages_output = extract_pdf_text(
+    pages = iter_pdf_text(
         pdf_path=options.pdf,
         languages=options.languages,
         dpi=options.dpi,
         min_confidence=options.min_confidence,
         use_gpu=options.gpu,
+        color_mode=options.color_mode,
     )
 
+    # Output is streamed to a temporary file and only published once every page
+    # is done, so a failed run leaves no truncated JSON (or earlier results
+    # overwritten) behind.
     if options.json_out:
         options.json_out.parent.mkdir(parents=True, exist_ok=True)
-        options.json_out.write_text(json.dumps(pages_output, indent=2), encoding="utf-8")
+        part_path = options.json_out.with_name(f"{options.json_out.name}.part")
+        try:
+            with part_path.open("wb", buffering=1 << 20) as out:
+                write_pages_json(pages, out)
+            part_path.replace(options.json_out)
+        finally:
+            part_path.unlink(missing_ok=True)
     else:
-        print(json.dumps(pages_output, indent=2))
+        with tempfile.TemporaryFile() as out:
+            write_pages_json(pages, out)
+            out.seek(0)
+            shutil.copyfileobj(out, sys.stdout.buffer, 1 << 20)
+        sys.stdout.buffer.flush()
 
     return 0
 
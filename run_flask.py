@@ -5,6 +5,7 @@
 - Uses `CDSW_APP_PORT` (or `PORT`, else 8080)
 - Exits if `CDSW_APP_PORT` is already in use
 - Honors `FLASK_DEBUG` and caps uploads at 5 MB
+- Runs CPU OCR in `OCR_PROCS` worker processes (default 2; 0 disables)
 """
 
 from __future__ import annotations
@@ -39,16 +40,42 @@ def main() -> int:
     # Languages and GPU usage can be controlled via env vars.
     preload_langs = [p.strip() for p in os.getenv("EASYOCR_LANGS", "en").split(",") if p.strip()]
     use_gpu = os.getenv("EASYOCR_USE_GPU", "").strip().lower() in {"1", "true", "yes", "on"}
+    backend = os.getenv("EASYOCR_BACKEND", "torch").strip().lower() or "torch"
+    processes = int(os.getenv("OCR_PROCS", "2"))
     try:
-        import easyocr  # type: ignore
+        import torch  # type: ignore
         import webapp as webapp_module
+        from ocr_backends import build_reader
 
-        print(
-            f"Preloading EasyOCR Reader (langs={preload_langs}, gpu={use_gpu}) ...",
-            flush=True,
-        )
-        webapp_module.PRELOADED_READER = easyocr.Reader(preload_langs, gpu=use_gpu)
-        print("EasyOCR Reader preloaded.", flush=True)
+        # Allow TF32 for matmuls that stay in FP32 outside autocast.
+        torch.set_float32_matmul_precision("high")
+
+        webapp_module.READER_USE_GPU = use_gpu
+        webapp_module.PRELOADED_LANGS = preload_langs
+        if processes > 0 and not use_gpu:
+            # CPU jobs run in worker processes, each preloading its own reader.
+            # Not used on GPU: a CUDA context cannot be shared across processes.
+            # Build (and drop) one reader here first so model downloads and
+            # ONNX exports happen once, not concurrently in every worker.
+            print(
+                f"Preparing EasyOCR models (langs={preload_langs}, backend={backend}) ...",
+                flush=True,
+            )
+            build_reader(preload_langs, use_gpu, backend)
+            print(
+                f"Starting {processes} OCR worker processes (langs={preload_langs}, "
+                f"backend={backend}) ...",
+                flush=True,
+            )
+            webapp_module._start_pool(processes, preload_langs, use_gpu)
+        else:
+            print(
+                f"Preloading EasyOCR Reader (langs={preload_langs}, gpu={use_gpu}, "
+                f"backend={backend}) ...",
+                flush=True,
+            )
+            webapp_module.PRELOADED_READER = build_reader(preload_langs, use_gpu, backend)
+            print("EasyOCR Reader preloaded.", flush=True)
     except Exception as e:  # pragma: no cover - best-effort preload
         print(f"Warning: failed to preload EasyOCR Reader: {e}", file=sys.stderr)
 
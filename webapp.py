@@ -10,11 +10,19 @@ Routes:
 
 from __future__ import annotations
 
+import gc
+import hashlib
 import json
+import multiprocessing
 import os
+import threading
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, List
 
 from flask import (
     Flask,
@@ -29,15 +37,45 @@ from flask import (
 from werkzeug.utils import secure_filename
 
 # Import OCR functionality lazily inside the upload route to keep startup fast
+if TYPE_CHECKING:  # pragma: no cover
+    import easyocr
 
 
 BASE_DIR = Path(__file__).resolve().parent
 UPLOADS_DIR = BASE_DIR / "uploads"
+# Maps a PDF digest + OCR options to the job directory holding its results.
+HASH_INDEX_DIR = UPLOADS_DIR / ".by_hash"
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
 
 # Will be set by run_flask.py at startup when available
 PRELOADED_READER = None  # type: ignore
+PRELOADED_LANGS: List[str] = ["en"]
+READER_USE_GPU = False
+
+# Readers are expensive to build, so the preloaded one is kept for the lifetime
+# of the process and the most recently used others in a small LRU. Language
+# sets come from the upload form, so the LRU bounds memory whatever is asked.
+_READER_CACHE: OrderedDict[frozenset[str], easyocr.Reader] = OrderedDict()
+_READER_CACHE_SIZE = max(1, int(os.getenv("OCR_READER_CACHE", "2")))
+_READER_CACHE_LOCK = threading.Lock()
+_READER_BUILD_LOCKS: dict[frozenset[str], threading.Lock] = {}
+
+# OCR jobs run on a bounded pool instead of one thread per upload. Cached
+# readers are shared by all jobs and are not reentrant on GPU, so GPU use is
+# gated separately (by default one job at a time) to keep GPU memory bounded.
+OCR_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("OCR_CONCURRENCY") or os.cpu_count() or 1),
+    thread_name_prefix="ocr-job",
+)
+GPU_SEM = threading.Semaphore(int(os.getenv("OCR_GPU_CONCURRENCY", "1")))
+
+# Started by run_flask.py (``_start_pool``) for CPU inference: OCR then runs in
+# worker processes (each with its own readers) so Python-level work is not
+# serialized by the GIL. A pool whose worker died is replaced on first use.
+OCR_POOL: ProcessPoolExecutor | None = None
+_OCR_POOL_ARGS: tuple | None = None
+_OCR_POOL_LOCK = threading.Lock()
 
 
 def _default_form_values() -> dict:
@@ -54,6 +92,252 @@ def _parse_languages(raw: str | None) -> List[str]:
     return langs or ["en"]
 
 
+def _parse_number(name: str, default: float, kind: type, lo: float, hi: float):
+    """Read a numeric form field, aborting with 400 if it is malformed or out of range."""
+    raw = request.form.get(name)
+    if raw is None or not raw.strip():
+        return default
+    try:
+        value = kind(raw)
+    except ValueError:
+        abort(400, f"Invalid {name}: {raw!r}.")
+    # Written as a single chained comparison so NaN is rejected too.
+    if not lo <= value <= hi:
+        abort(400, f"{name} must be between {lo} and {hi}.")
+    return value
+
+
+def _model_settings() -> str:
+    """Inference settings that change OCR output; results from others are not reused."""
+    backend = (os.getenv("EASYOCR_BACKEND") or "torch").strip().lower()
+    precision = (os.getenv("EASYOCR_PRECISION") or "default").strip().lower()
+    compiled = os.getenv("EASYOCR_COMPILE", "").strip().lower() in {"1", "true", "yes", "on"}
+    return f"{backend}|{precision}|{int(compiled)}|{'gpu' if READER_USE_GPU else 'cpu'}"
+
+
+def _job_key(pdf_digest: str, langs: List[str], dpi: int, min_conf: float) -> str:
+    """Cache key for OCR output: the PDF digest plus every option that affects it."""
+    # Languages are sorted to match the reader cache, which ignores their order.
+    options = f"{pdf_digest}|{','.join(sorted(langs))}|{dpi}|{min_conf!r}|{_model_settings()}"
+    return hashlib.blake2b(options.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _cached_job_dir(key: str) -> Path | None:
+    entry = HASH_INDEX_DIR / key
+    if (entry / "ocr.json").exists():
+        return entry.resolve()
+    return None
+
+
+def _remember_job(key: str, job_dir: Path) -> None:
+    HASH_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_link = HASH_INDEX_DIR / f".{key}.{job_dir.name}"
+    tmp_link.symlink_to(Path("..") / job_dir.name, target_is_directory=True)
+    os.replace(tmp_link, HASH_INDEX_DIR / key)
+
+
+def _etag_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.etag")
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_etag(path: Path, etag: str) -> None:
+    """Store the ETag for ``path`` in a sidecar so downloads need not rehash it."""
+    _etag_path(path).write_text(etag, encoding="utf-8")
+
+
+def _send_cached(path: Path, mimetype: str):
+    """Send ``path`` with validators so browsers can revalidate and get a 304."""
+    etag_path = _etag_path(path)
+    etag = etag_path.read_text(encoding="utf-8").strip() if etag_path.exists() else True
+    return send_file(
+        path,
+        mimetype=mimetype,
+        as_attachment=False,
+        conditional=True,
+        etag=etag,
+        last_modified=path.stat().st_mtime,
+        max_age=3600,
+    )
+
+
+def _cached_reader(key: frozenset[str]) -> easyocr.Reader | None:
+    with _READER_CACHE_LOCK:
+        reader = _READER_CACHE.get(key)
+        if reader is not None:
+            _READER_CACHE.move_to_end(key)
+        return reader
+
+
+def _get_reader(langs: List[str]) -> easyocr.Reader:
+    """Return the cached reader for ``langs``, building it on first use."""
+    key = frozenset(langs)
+    if PRELOADED_READER is not None and key == frozenset(PRELOADED_LANGS):
+        return PRELOADED_READER
+    reader = _cached_reader(key)
+    if reader is not None:
+        return reader
+
+    # Build outside the cache lock so jobs whose reader is cached are not held
+    # up; the per-language-set lock keeps concurrent jobs from building twice.
+    with _READER_CACHE_LOCK:
+        build_lock = _READER_BUILD_LOCKS.setdefault(key, threading.Lock())
+    with build_lock:
+        reader = _cached_reader(key)
+        if reader is not None:
+            return reader
+        from ocr_backends import build_reader
+
+        try:
+            reader = build_reader(langs, use_gpu=READER_USE_GPU)
+            with _READER_CACHE_LOCK:
+                _READER_CACHE[key] = reader
+                while len(_READER_CACHE) > _READER_CACHE_SIZE:
+                    _READER_CACHE.popitem(last=False)
+        finally:
+            with _READER_CACHE_LOCK:
+                _READER_BUILD_LOCKS.pop(key, None)
+    return reader
+
+
+def _init_reader(langs: List[str], use_gpu: bool, threads: int) -> None:
+    """Process pool initializer: preload a reader in each worker process.
+
+    ``threads`` caps intra-op parallelism (torch, and ONNX Runtime through
+    ``ocr_backends``) so the workers share the cores instead of each using all
+    of them. Failures are logged, not raised: an initializer error breaks the
+    whole pool for good, whereas without a preload ``_get_reader`` retries
+    lazily.
+    """
+    import torch  # type: ignore
+
+    from ocr_backends import build_reader
+
+    global PRELOADED_READER, PRELOADED_LANGS, READER_USE_GPU
+    READER_USE_GPU = use_gpu
+    PRELOADED_LANGS = list(langs)
+    torch.set_num_threads(threads)
+    try:
+        PRELOADED_READER = build_reader(langs, use_gpu)
+    except Exception:
+        PRELOADED_READER = None
+        app.logger.exception("OCR worker %d failed to preload its reader", os.getpid())
+
+
+def _start_pool(processes: int, langs: List[str], use_gpu: bool) -> ProcessPoolExecutor:
+    """Start ``processes`` OCR workers, each preloading a reader for ``langs``."""
+    global OCR_POOL, _OCR_POOL_ARGS
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_reader,
+        initargs=(langs, use_gpu, max(1, (os.cpu_count() or 1) // processes)),
+    )
+    # Each submit spawns a worker while none is idle, so this starts (and
+    # preloads) all of them before the first job arrives.
+    for _ in range(processes):
+        pool.submit(int)
+    _OCR_POOL_ARGS = (processes, langs, use_gpu)
+    OCR_POOL = pool
+    return pool
+
+
+def _replace_pool(broken: ProcessPoolExecutor) -> None:
+    """Swap in a fresh pool for ``broken``, unless another job already did."""
+    with _OCR_POOL_LOCK:
+        if OCR_POOL is broken and _OCR_POOL_ARGS is not None:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _start_pool(*_OCR_POOL_ARGS)
+
+
+def _release_memory() -> None:
+    """Free per-job garbage and hand cached CUDA blocks back to the driver.
+
+    Without this the caching allocator keeps every job's transient peak and
+    fragments across jobs of different page sizes until it runs out of memory.
+    """
+    gc.collect()
+    try:
+        import torch  # type: ignore
+    except ImportError:  # pragma: no cover - torch ships with easyocr
+        return
+    if not (torch.cuda.is_available() and torch.cuda.is_initialized()):
+        return
+    torch.cuda.empty_cache()
+    torch.cuda.ipc_collect()
+    if app.debug:
+        app.logger.debug(
+            "CUDA memory after job: %.1f MiB reserved, %.1f MiB allocated",
+            torch.cuda.memory_reserved() / 2**20,
+            torch.cuda.memory_allocated() / 2**20,
+        )
+
+
+def _run_ocr(pdf: Path, out_dir: Path, langs: List[str], dpi_: int, min_c: float) -> None:
+    """OCR ``pdf`` and write ``ocr.json`` (plus its ETag) into ``out_dir``."""
+    from ocr_extract import iter_pdf_text, write_pages_json
+
+    reader = _get_reader(langs)
+
+    # Stream pages into a partial file; the view treats ocr.json as the
+    # completion marker, so it only appears once the document is done.
+    part_path = out_dir / "ocr.json.part"
+    try:
+        with GPU_SEM if READER_USE_GPU else nullcontext():
+            pages = iter_pdf_text(
+                pdf_path=pdf,
+                languages=langs,
+                dpi=dpi_,
+                min_confidence=min_c,
+                use_gpu=READER_USE_GPU,
+                reader=reader,
+            )
+            with part_path.open("wb", buffering=1 << 20) as out:
+                write_pages_json(pages, out)
+        json_path = out_dir / "ocr.json"
+        _write_etag(json_path, _file_digest(part_path))
+        part_path.replace(json_path)
+    finally:
+        part_path.unlink(missing_ok=True)  # only left behind if OCR failed
+        _release_memory()
+
+
+def _worker(
+    pdf: Path,
+    out_dir: Path,
+    langs: List[str],
+    dpi_: int,
+    min_c: float,
+    cache_key: str | None = None,
+) -> None:
+    try:
+        pool = OCR_POOL
+        if pool is not None:
+            try:
+                pool.submit(_run_ocr, pdf, out_dir, langs, dpi_, min_c).result()
+            except BrokenProcessPool:
+                # A worker died (OOM kill, crash in native code). Fail this job
+                # only: later jobs get a new pool instead of the broken one.
+                _replace_pool(pool)
+                raise RuntimeError("The OCR worker process died; please try again.")
+        else:
+            _run_ocr(pdf, out_dir, langs, dpi_, min_c)
+        if cache_key:
+            try:
+                _remember_job(cache_key, out_dir)
+            except OSError:
+                pass  # Caching is best-effort; the job itself succeeded.
+    except Exception as e:  # Write error to a file for UI to pick up
+        (out_dir / "error.txt").write_text(str(e), encoding="utf-8")
+
+
 @app.get("/")
 def index():
     return render_template("index.html", **_default_form_values())
@@ -67,66 +351,33 @@ def upload():
 
     # Parse options
     languages = _parse_languages(request.form.get("languages"))
-    try:
-        dpi = int(request.form.get("dpi", 300))
-    except Exception:
-        dpi = 300
-    try:
-        min_conf = float(request.form.get("min_conf", 0.2))
-    except Exception:
-        min_conf = 0.2
+    # Reject bad options before anything is read, hashed or written to disk.
+    dpi = _parse_number("dpi", 300, int, 72, 600)
+    min_conf = _parse_number("min_conf", 0.2, float, 0.0, 1.0)
+
+    # Identical PDFs uploaded with identical options reuse an earlier job.
+    data = file.stream.read()
+    pdf_digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    cache_key = _job_key(pdf_digest, languages, dpi, min_conf)
+    cached_dir = _cached_job_dir(cache_key)
 
     # Workspace for this job
     uid = uuid.uuid4().hex[:12]
     job_dir = UPLOADS_DIR / uid
+    if cached_dir is not None:
+        job_dir.symlink_to(cached_dir.name, target_is_directory=True)
+        return redirect(url_for("view", uid=uid))
     job_dir.mkdir(parents=True, exist_ok=True)
 
     # Persist PDF
     filename = secure_filename(file.filename or "document.pdf") or "document.pdf"
     pdf_path = job_dir / "document.pdf"
-    file.save(pdf_path)
+    pdf_path.write_bytes(data)
+    _write_etag(pdf_path, pdf_digest)
 
-    # Run OCR in a background thread and immediately redirect to the view page.
+    # Run OCR on the job pool and immediately redirect to the view page.
     # The view page will show a processing indicator until OCR is complete.
-    def _worker(pdf: Path, out_dir: Path, langs: List[str], dpi_: int, min_c: float):
-        try:
-            from ocr_extract import extract_pdf_text
-
-            # Reuse preloaded reader only for the same language set; else fall back
-            # to a new reader (keeps correctness if user changes languages).
-            use_preloaded = False
-            reader = None
-            try:
-                pre = globals().get("PRELOADED_READER")
-                if pre is not None:
-                    # Best-effort: use preloaded reader if the request only asks for 'en'
-                    if set(langs) == {"en"}:
-                        reader = pre
-                        use_preloaded = True
-            except Exception:
-                reader = None
-
-            pages = extract_pdf_text(
-                pdf_path=pdf,
-                languages=langs,
-                dpi=dpi_,
-                min_confidence=min_c,
-                use_gpu=False,
-                reader=reader,
-            )
-
-            (out_dir / "ocr.json").write_text(
-                json.dumps(pages, indent=2), encoding="utf-8"
-            )
-        except Exception as e:  # Write error to a file for UI to pick up
-            (out_dir / "error.txt").write_text(str(e), encoding="utf-8")
-
-    import threading
-
-    t = threading.Thread(
-        target=_worker, args=(pdf_path, job_dir, languages, dpi, min_conf), daemon=True
-    )
-    t.start()
+    OCR_EXECUTOR.submit(_worker, pdf_path, job_dir, languages, dpi, min_conf, cache_key)
 
     return redirect(url_for("view", uid=uid))
 
@@ -167,7 +418,7 @@ def get_pdf(uid: str):
     pdf_path = job_dir / "document.pdf"
     if not pdf_path.exists():
         abort(404)
-    return send_file(pdf_path, mimetype="application/pdf", as_attachment=False)
+    return _send_cached(pdf_path, "application/pdf")
 
 
 @app.get("/ocr/<uid>.json")
@@ -176,7 +427,7 @@ def get_ocr_json(uid: str):
     json_path = job_dir / "ocr.json"
     if not json_path.exists():
         abort(404)
-    return send_file(json_path, mimetype="application/json", as_attachment=False)
+    return _send_cached(json_path, "application/json")
 
 
 # Basic health endpoint for quick checks